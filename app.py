@@ -4,10 +4,12 @@ from flask import Flask, request, render_template, abort
 from flask_caching import Cache
 from urllib.parse import quote, unquote
 import requests
+from requests.adapters import HTTPAdapter
+import functools
 import re
 import os
 from datetime import datetime, timezone
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
 from orgpython import to_html
 
 app = Flask(__name__)
@@ -16,22 +18,90 @@ app = Flask(__name__)
 CACHE_TIMEOUT = int(os.getenv("CACHE_TIMEOUT", "30"))
 CACHE_FILE_TIMEOUT = int(os.getenv("CACHE_FILE_TIMEOUT", "30"))
 
-# Configure Flask-Caching
-app.config["CACHE_TYPE"] = "SimpleCache"
+# Configure Flask-Caching: share the cache between gunicorn workers through
+# Redis when REDIS_URL is set, otherwise keep a per-process SimpleCache
+REDIS_URL = os.getenv("REDIS_URL", "")
+if REDIS_URL:
+    app.config["CACHE_TYPE"] = "RedisCache"
+    app.config["CACHE_REDIS_URL"] = REDIS_URL
+else:
+    app.config["CACHE_TYPE"] = "SimpleCache"
 app.config["CACHE_DEFAULT_TIMEOUT"] = CACHE_TIMEOUT
 
 cache = Cache(app)
 
+# Optional on-disk cache of compiled templates, so freshly started workers
+# load template bytecode instead of compiling the sources again. Off by
+# default: with a handful of templates it only pays off when workers churn.
+JINJA_BYTECODE_CACHE_DIR = os.getenv("JINJA_BYTECODE_CACHE", "")
+jinja_bytecode_cache = None
+if JINJA_BYTECODE_CACHE_DIR:
+    os.makedirs(JINJA_BYTECODE_CACHE_DIR, exist_ok=True)
+    jinja_bytecode_cache = FileSystemBytecodeCache(JINJA_BYTECODE_CACHE_DIR)
+    app.jinja_env.bytecode_cache = jinja_bytecode_cache
+
+# Keywords are case-insensitive in org-mode (#+title: is as valid as
+# #+TITLE:). Use [ \t]* after the colon instead of \s* so an empty value
+# does not swallow the next line (\s matches newlines).
+METADATA_PATTERN = re.compile(
+    r"^\s*\#\+(TITLE|NICK|DESCRIPTION|AVATAR|PINNED):[ \t]*(\S.*)$",
+    re.MULTILINE | re.IGNORECASE,
+)
+# Heading case varies across feeds: "* posts"
+POSTS_SECTION_PATTERN = re.compile(r"^\*\s+Posts\s*$", re.MULTILINE | re.IGNORECASE)
+BLOCK_PATTERN = re.compile(
+    r"^[ \t]*#\+BEGIN_(\w+)\b.*?^[ \t]*#\+END_\1[ \t]*$",
+    re.MULTILINE | re.DOTALL | re.IGNORECASE,
+)
+# [^\S\n] rather than \s: a bare "**" must not pick up the next line as its
+# ID, but a CRLF line ending ("**\r") is still a header
+POST_HEADER_PATTERN = re.compile(r"^\*\*(?:[^\S\n]+(\S.*?))?[^\S\n]*$", re.MULTILINE)
+PROPERTIES_PATTERN = re.compile(
+    r":PROPERTIES:\s*\n(.*?)\n:END:", re.DOTALL | re.IGNORECASE
+)
+# Language and header args (:results ...) are optional
+CODE_BLOCK_PATTERN = re.compile(
+    r"^[ \t]*#\+BEGIN_SRC(?:[ \t]+([\w-]+))?[^\n]*\n"
+    r"(.*?)\n[ \t]*#\+END_SRC[ \t]*$",
+    re.MULTILINE | re.DOTALL | re.IGNORECASE,
+)
+CODE_PLACEHOLDER_PATTERN = re.compile(r"___CODE_BLOCK_(\d+)___")
+# Source blocks are rendered verbatim: escape them in one translate() pass
+CODE_ESCAPE_TABLE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;"})
+CODE_BLOCK_HTML_OPEN = (
+    '<pre style="background-color: #f6f8fa; padding: 16px; border-radius: 6px; '
+    'overflow-x: auto; margin: 10px 0;"><code class="language-'
+)
+IMG_TAG_PATTERN = re.compile(r'<img\s+([^>]*?)src="([^"]+)"([^>]*?)>')
+# Post-processing walks the org-python output once, token by token: an <a>
+# tag plus its plain-text label when it has one (for mentions), or any other
+# tag. Tags are never linkified (no lookbehind, no backtracking); only the
+# text between them is searched for plain URLs.
+HTML_TOKEN_PATTERN = re.compile(
+    r"<a (?P<attrs>[^>]*)>(?:@?(?P<label>[^<]+)</a>)?"
+    r"|<(?P<closing>/?)(?P<name>\w*)[^<>]*>"
+)
+URL_PATTERN = re.compile(r'https?://[^\s<>"]+')
+# Image URLs: the path (before any query string or fragment) ends in an
+# image extension
+IMAGE_URL_PATTERN = re.compile(
+    r"[^?#]*\.(?:jpe?g|png|gif|webp|svg|bmp|ico)(?:[?#]|$)", re.IGNORECASE
+)
+WHITESPACE_PATTERN = re.compile(r"\s+")
+HTML_TAG_PATTERN = re.compile(r"<[^>]+>")
+
 
 class OrgSocialParser:
     def __init__(self):
         self.metadata = {}
         self.posts = []
+        self.posts_by_id = {}
 
     def parse_content(self, content):
         """Parse the org social content and extract metadata and posts"""
         self.metadata = {}
         self.posts = []
+        self.posts_by_id = {}
 
         # Extract global metadata
         self._extract_metadata(content)
@@ -43,57 +113,35 @@ class OrgSocialParser:
 
     def _extract_metadata(self, content):
         """Extract global metadata from the org file"""
-        # Keywords are case-insensitive in org-mode (#+title: is as valid as
-        # #+TITLE:). Use [ \t]* after the colon instead of \s* so an empty
-        # value does not swallow the next line (\s matches newlines).
-        metadata_patterns = {
-            "TITLE": r"^\s*\#\+TITLE:[ \t]*(\S.*)$",
-            "NICK": r"^\s*\#\+NICK:[ \t]*(\S.*)$",
-            "DESCRIPTION": r"^\s*\#\+DESCRIPTION:[ \t]*(\S.*)$",
-            "AVATAR": r"^\s*\#\+AVATAR:[ \t]*(\S.*)$",
-            "PINNED": r"^\s*\#\+PINNED:[ \t]*(\S.*)$",
-        }
-
-        for key, pattern in metadata_patterns.items():
-            match = re.search(pattern, content, re.MULTILINE | re.IGNORECASE)
-            if match:
-                self.metadata[key] = match.group(1).strip()
+        # One scan for every keyword; the first occurrence of each one wins
+        for match in METADATA_PATTERN.finditer(content):
+            self.metadata.setdefault(match.group(1).upper(), match.group(2).strip())
 
     def _extract_posts(self, content):
         """Extract all posts from the org file"""
-        # Find the Posts section (heading case varies across feeds: "* posts")
-        posts_pattern = r"^\*\s+Posts\s*$"
-        posts_section_match = re.search(
-            posts_pattern, content, re.MULTILINE | re.IGNORECASE
-        )
+        # Find the Posts section
+        posts_section_match = POSTS_SECTION_PATTERN.search(content)
         if not posts_section_match:
             print("Posts section not found")
             return
 
         posts_content = content[posts_section_match.end() :]
 
-        # Ranges of #+BEGIN_.../#+END_... blocks: a "**" line inside them is
-        # content (e.g. an org example in a src block), not a post header.
-        block_ranges = [
-            (m.start(), m.end())
-            for m in re.finditer(
-                r"^[ \t]*#\+BEGIN_(\w+)\b.*?^[ \t]*#\+END_\1[ \t]*$",
-                posts_content,
-                re.MULTILINE | re.DOTALL | re.IGNORECASE,
-            )
-        ]
-
-        def in_block(pos):
-            return any(start <= pos < end for start, end in block_ranges)
+        # #+BEGIN_.../#+END_... blocks: a "**" line inside them is content
+        # (e.g. an org example in a src block), not a post header. Blocks and
+        # headers both come in document order, so walk them side by side.
+        blocks = BLOCK_PATTERN.finditer(posts_content)
+        current_block = next(blocks, None)
 
         # Find all ** headers (posts) - support both formats:
         # Format 1: ** (ID in properties)
         # Format 2: ** <timestamp> (ID in header)
-        post_pattern = r"^\*\*(?:\s+(.+?))?$"
         post_matches = []
 
-        for match in re.finditer(post_pattern, posts_content, re.MULTILINE):
-            if in_block(match.start()):
+        for match in POST_HEADER_PATTERN.finditer(posts_content):
+            while current_block and current_block.end() <= match.start():
+                current_block = next(blocks, None)
+            if current_block and current_block.start() <= match.start():
                 continue
             header_id = match.group(1).strip() if match.group(1) else None
             post_matches.append(
@@ -122,6 +170,8 @@ class OrgSocialParser:
             post = self._parse_post_block(block, post_match["header_id"])
             if post and post.get("ID"):
                 self.posts.append(post)
+                # Duplicate IDs: the first post wins, as in a linear scan
+                self.posts_by_id.setdefault(post["ID"], post)
                 print(f"Post added with ID: {post.get('ID')}")
 
     def _parse_post_block(self, block, header_id=None):
@@ -133,13 +183,23 @@ class OrgSocialParser:
         """
         post = {}
 
-        # Extract properties
-        properties_match = re.search(
-            r":PROPERTIES:\s*\n(.*?)\n:END:", block, re.DOTALL | re.IGNORECASE
-        )
-        if properties_match:
-            properties_content = properties_match.group(1)
-
+        # Extract properties: plain substring search for the usual spelling
+        properties_content = None
+        content_start = 0
+        drawer_start = block.find(":PROPERTIES:")
+        drawer_end = block.find("\n:END:", drawer_start) if drawer_start != -1 else -1
+        if drawer_end != -1:
+            properties_content = block[drawer_start + len(":PROPERTIES:") : drawer_end]
+            content_start = drawer_end + len("\n:END:")
+        else:
+            # Drawer names are case-insensitive in org-mode; leave the rare
+            # ":properties:" spelling to the regex.
+            properties_match = PROPERTIES_PATTERN.search(block)
+            if properties_match:
+                properties_content = properties_match.group(1)
+                content_start = properties_match.end()
+
+        if properties_content is not None:
             # Parse each property using simple string operations
             for line in properties_content.split("\n"):
                 line = line.strip()
@@ -160,41 +220,45 @@ class OrgSocialParser:
 
         # Extract post content: anything after the :PROPERTIES: drawer, or the
         # whole block if there is no drawer. A drawer-only post yields "".
-        if properties_match:
-            post["content"] = block[properties_match.end() :].strip()
-        else:
-            post["content"] = block.strip()
+        post["content"] = block[content_start:].strip()
 
         return post
 
     def find_post_by_id(self, post_id):
         """Find a specific post by ID"""
-        for post in self.posts:
-            if post.get("ID") == post_id:
-                return post
-        return None
+        return self.posts_by_id.get(post_id)
+
+
+def og_description(value, max_length=120):
+    """Jinja filter: collapse post content into a one-line og:description"""
+    # HTML tag filter first, so the spaces around a removed tag collapse below
+    text = HTML_TAG_PATTERN.sub("", value)
+    # Collapse all whitespace (newlines included) to single spaces
+    text = WHITESPACE_PATTERN.sub(" ", text)
+    if len(text) > max_length:
+        text = text[:max_length].rstrip() + "..."
+    return text.strip()
+
+
+@functools.cache
+def _jinja_env(template_dir):
+    """Build the Jinja environment for a template directory once per process.
+
+    Templates ship with the image, so auto_reload is off: compiled templates
+    stay in the environment cache without a stat() check on every render.
+    """
+    env = Environment(
+        loader=FileSystemLoader(template_dir),
+        auto_reload=False,
+        bytecode_cache=jinja_bytecode_cache,
+    )
+    env.filters["og_description"] = og_description
+    return env
 
 
 class PreviewGenerator:
     def __init__(self, template_dir=".", template_name="template.html"):
-        self.env = Environment(loader=FileSystemLoader(template_dir))
-
-        def og_description(value, max_length=120):
-            import re
-
-            # Replace newlines with spaces
-            text = value.replace("\r\n", " ").replace("\n", " ").replace("\r", " ")
-            # Collapse all whitespace to single spaces
-            text = re.sub(r"\s+", " ", text)
-            # HTML tag filter
-            text = re.sub(r"<[^>]+>", "", text)
-            # Collapse multiple spaces
-            text = re.sub(r" +", " ", text)
-            if len(text) > max_length:
-                text = text[:max_length].rstrip() + "..."
-            return text.strip()
-
-        self.env.filters["og_description"] = og_description
+        self.env = _jinja_env(template_dir)
         self.template = self.env.get_template(template_name)
 
     def generate_preview(self, post, metadata, feed_url=""):
@@ -257,88 +321,89 @@ class PreviewGenerator:
         try:
             # Pre-process: Extract code blocks and replace with placeholders
             code_blocks = []
-            # Language and header args (:results ...) are optional
-            code_block_pattern = (
-                r"^[ \t]*#\+BEGIN_SRC(?:[ \t]+([\w-]+))?[^\n]*\n"
-                r"(.*?)\n[ \t]*#\+END_SRC[ \t]*$"
-            )
 
             def replace_code_block(match):
                 lang = match.group(1) or "text"
                 code = match.group(2)
                 # HTML escape the code content
-                code_escaped = (
-                    code.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
-                )
+                code_escaped = code.translate(CODE_ESCAPE_TABLE)
                 placeholder = f"___CODE_BLOCK_{len(code_blocks)}___"
                 code_blocks.append(
-                    {"lang": lang, "code": code_escaped, "placeholder": placeholder}
+                    f'{CODE_BLOCK_HTML_OPEN}{lang}">{code_escaped}</code></pre>'
                 )
                 return placeholder
 
-            # Replace code blocks with placeholders
-            content_processed = re.sub(
-                code_block_pattern,
-                replace_code_block,
-                content,
-                flags=re.MULTILINE | re.DOTALL | re.IGNORECASE,
-            )
+            def restore_code_block(match):
+                index = int(match.group(1))
+                if index < len(code_blocks):
+                    return code_blocks[index]
+                return match.group(0)
+
+            # Replace code blocks with placeholders. Most posts have no
+            # markup at all, so each regex pass below is gated on a cheap
+            # substring check first.
+            content_processed = content
+            if "#+" in content:
+                content_processed = CODE_BLOCK_PATTERN.sub(replace_code_block, content)
 
             # Convert Org Mode to HTML using org-python
             html = to_html(content_processed, toc=False, highlight=True)
 
-            # Restore code blocks with proper HTML formatting
-            for block in code_blocks:
-                code_html = f'<pre style="background-color: #f6f8fa; padding: 16px; border-radius: 6px; overflow-x: auto; margin: 10px 0;"><code class="language-{block["lang"]}">{block["code"]}</code></pre>'
-                html = html.replace(block["placeholder"], code_html)
-
-            # Custom styling and post-processing
-            # Make images full width
-            html = re.sub(
-                r'<img\s+([^>]*?)src="([^"]+)"([^>]*?)>',
-                r'<img \1src="\2"\3 style="width: 100%; height: auto; border-radius: 8px; margin: 10px 0;">',
-                html,
-            )
-
-            # Style links with our color
-            html = html.replace("<a ", '<a style="color: #1d9bf0;" target="_blank" ')
-
-            # Handle org-social mentions (after org-python processing)
-            html = re.sub(
-                r'<a[^>]*href="org-social:([^"]+)"[^>]*>@?([^<]+)</a>',
-                r'<a href="#" style="color: #1d9bf0;">@\2</a> ',
-                html,
-            )
-
-            # Convert plain text URLs to clickable links or images
-            # Match URLs that are not already part of an href attribute
-            def linkify_urls(text):
-                # Pattern to match URLs not already in href="" or src=""
-                url_pattern = r'(?<!href=")(?<!src=")(https?://[^\s<>"]+)'
-
-                def replace_url(match):
-                    url = match.group(0)
-                    # Check if URL is an image (check path before query parameters)
-                    image_extensions = (
-                        ".jpg",
-                        ".jpeg",
-                        ".png",
-                        ".gif",
-                        ".webp",
-                        ".svg",
-                        ".bmp",
-                        ".ico",
-                    )
-                    # Extract the path part before query parameters
-                    url_path = url.split("?")[0].split("#")[0].lower()
-                    if url_path.endswith(image_extensions):
-                        return f'<img src="{url}" style="width: 100%; height: auto; border-radius: 8px; margin: 10px 0;" alt="Image">'
+            # Restore code blocks with proper HTML formatting, all in one pass
+            if code_blocks:
+                html = CODE_PLACEHOLDER_PATTERN.sub(restore_code_block, html)
+
+            # Custom styling and post-processing, in a single walk over the
+            # HTML: full-width images, links in our color, org-social
+            # mentions as @nick, and plain text URLs turned into clickable
+            # links or images (tag attributes and link labels untouched)
+            def replace_url(match):
+                url = match.group(0)
+                if IMAGE_URL_PATTERN.match(url):
+                    return f'<img src="{url}" style="width: 100%; height: auto; border-radius: 8px; margin: 10px 0;" alt="Image">'
+                else:
+                    return f'<a style="color: #1d9bf0;" target="_blank" href="{url}">{url}</a>'
+
+            parts = []
+            pos = 0
+            in_anchor = False
+            for match in HTML_TOKEN_PATTERN.finditer(html):
+                segment = html[pos : match.start()]
+                if not in_anchor and "http" in segment:
+                    segment = URL_PATTERN.sub(replace_url, segment)
+                parts.append(segment)
+                pos = match.end()
+
+                attrs, label = match.group("attrs"), match.group("label")
+                if attrs is not None:
+                    # Labelled links are consumed up to </a>; a bare opening
+                    # tag leaves us inside the link until its closing tag
+                    in_anchor = label is None
+                    if label is not None and 'href="org-social:' in attrs:
+                        parts.append(
+                            f'<a href="#" style="color: #1d9bf0;">@{label}</a> '
+                        )
                     else:
-                        return f'<a style="color: #1d9bf0;" target="_blank" href="{url}">{url}</a>'
-
-                return re.sub(url_pattern, replace_url, text)
+                        parts.append('<a style="color: #1d9bf0;" target="_blank" ')
+                        parts.append(match.group(0)[3:])
+                    continue
+
+                tag = match.group(0)
+                name = match.group("name")
+                if name == "img":
+                    tag = IMG_TAG_PATTERN.sub(
+                        r'<img \1src="\2"\3 style="width: 100%; height: auto; border-radius: 8px; margin: 10px 0;">',
+                        tag,
+                    )
+                elif name.lower() == "a":
+                    in_anchor = not match.group("closing")
+                parts.append(tag)
 
-            html = linkify_urls(html)
+            tail = html[pos:]
+            if not in_anchor and "http" in tail:
+                tail = URL_PATTERN.sub(replace_url, tail)
+            parts.append(tail)
+            html = "".join(parts)
 
             return html or "No content"
 
@@ -349,11 +414,25 @@ class PreviewGenerator:
 
     def _format_timestamp(self, timestamp):
         """Format timestamp for display"""
-        try:
-            dt = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
-            return dt.strftime("%Y-%m-%d")
-        except Exception:
-            return "2024-01-01"
+        return _format_short_timestamp(timestamp)
+
+
+# Post IDs are timestamps and the same ones are formatted over and over
+# (every preview of a post, every blog render), so memoize the conversions.
+@functools.lru_cache(maxsize=4096)
+def _format_short_timestamp(timestamp):
+    try:
+        dt = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+        return dt.strftime("%Y-%m-%d")
+    except Exception:
+        return "2024-01-01"
+
+
+# Shared by every request: the template is loaded once at import, resolved
+# against the app root (like render_template) rather than the working dir
+PREVIEW_GENERATOR = PreviewGenerator(
+    template_dir=os.path.join(app.root_path, "templates"), template_name="post.html"
+)
 
 
 def parse_post_url(post_url):
@@ -377,23 +456,51 @@ def parse_post_url(post_url):
     return file_url, post_id
 
 
+# Shared HTTP session: keep-alive connections to feed hosts are reused
+# across cache misses instead of a new TCP/TLS handshake per fetch
+HTTP_SESSION = requests.Session()
+_http_adapter = HTTPAdapter(pool_connections=32, pool_maxsize=16)
+HTTP_SESSION.mount("https://", _http_adapter)
+HTTP_SESSION.mount("http://", _http_adapter)
+
+
 @cache.memoize(timeout=CACHE_FILE_TIMEOUT)
 def fetch_social_org(url):
     """Fetch a social.org file from a URL"""
     try:
-        response = requests.get(url, timeout=10)
+        response = HTTP_SESSION.get(url, timeout=10)
         response.raise_for_status()
-        return response.text
+        # social.org files are UTF-8. Decode the body directly instead of
+        # response.text, which sniffs the charset and falls back to
+        # ISO-8859-1 for text/plain without one. utf-8-sig drops a BOM.
+        return response.content.decode("utf-8-sig", errors="replace")
     except Exception as e:
         print(f"Error fetching {url}: {e}")
         return None
 
 
+@cache.memoize(timeout=CACHE_FILE_TIMEOUT)
+def parse_feed(url):
+    """Fetch and parse a social.org file, caching the parsed result
+
+    Returns the OrgSocialParser holding metadata, posts and posts_by_id, or
+    None if the file could not be fetched (None is not cached).
+    """
+    content = fetch_social_org(url)
+    if not content:
+        return None
+
+    parser = OrgSocialParser()
+    parser.parse_content(content)
+    return parser
+
+
 HOST_BASE_URL = "https://host.org-social.org"
 RELAY_RSS_URL = "https://relay.org-social.org/rss.xml"
 NICK_PATTERN = re.compile(r"[A-Za-z0-9_.-]{1,64}")
 
 
+@functools.lru_cache(maxsize=4096)
 def _post_datetime(post_id):
     try:
         dt = datetime.fromisoformat(post_id.replace("Z", "+00:00"))
@@ -404,6 +511,7 @@ def _post_datetime(post_id):
         return datetime.min.replace(tzinfo=timezone.utc)
 
 
+@functools.lru_cache(maxsize=4096)
 def _format_long_timestamp(post_id):
     try:
         dt = datetime.fromisoformat(post_id.replace("Z", "+00:00"))
@@ -466,15 +574,11 @@ def blog(nick):
         abort(400, "Invalid nick")
 
     file_url = f"{HOST_BASE_URL}/{nick}/social.org"
-    content = fetch_social_org(file_url)
-    if not content:
+    parser = parse_feed(file_url)
+    if not parser:
         abort(404, f"social.org not found for nick '{nick}'")
 
-    parser = OrgSocialParser()
-    parser.parse_content(content)
-
-    generator = PreviewGenerator(template_dir="templates", template_name="post.html")
-    posts = _build_blog_posts(parser, generator)
+    posts = _build_blog_posts(parser, PREVIEW_GENERATOR)
 
     metadata = parser.metadata
     display_nick = metadata.get("NICK", nick)
@@ -529,23 +633,19 @@ def preview():
             "Invalid post URL format. Expected: https://example.org/social.org#POST_ID",
         )
 
-    # Fetch the social.org file
-    content = fetch_social_org(file_url)
-    if not content:
+    # Fetch and parse the social.org file. The whole feed is parsed (not
+    # just up to post_id) so previews of its other posts hit the cache.
+    parser = parse_feed(file_url)
+    if not parser:
         abort(500, f"Could not fetch social.org file from {file_url}")
 
-    # Parse the content
-    parser = OrgSocialParser()
-    parser.parse_content(content)
-
     # Find the specific post
     post = parser.find_post_by_id(post_id)
     if not post:
         abort(404, f"Post with ID {post_id} not found")
 
     # Generate preview
-    generator = PreviewGenerator(template_dir="templates", template_name="post.html")
-    html = generator.generate_preview(post, parser.metadata, feed_url=file_url)
+    html = PREVIEW_GENERATOR.generate_preview(post, parser.metadata, feed_url=file_url)
 
     return html
 